@@ -0,0 +1,51 @@
+import heapq
+from collections.abc import Hashable
+
+
+class SpaceSaving:
+    """Top-k heavy hitters of a weighted stream with fixed memory.
+
+    Space-Saving algorithm (Metwally et al.): keeps at most k counters, an
+    unseen key replaces the smallest counter and inherits its count as error.
+    Counts are overestimated by at most the error.
+    """
+
+    def __init__(self, k: int = 100):
+        self.k = k
+        # key -> [count, error]
+        self._counters: dict[Hashable, list[float]] = {}
+        # (count, key), may contain outdated counts (counts only increase)
+        self._heap: list[tuple[float, Hashable]] = []
+
+    def update(self, key: Hashable, weight: float = 1.0):
+        if key in self._counters:
+            self._counters[key][0] += weight
+            return
+        if len(self._counters) < self.k:
+            self._counters[key] = [weight, 0.0]
+            heapq.heappush(self._heap, (weight, key))
+            return
+        # replace the key with the smallest count
+        while True:
+            count, smallest = heapq.heappop(self._heap)
+            if self._counters[smallest][0] == count:
+                break
+            heapq.heappush(self._heap, (self._counters[smallest][0], smallest))
+        del self._counters[smallest]
+        self._counters[key] = [count + weight, count]
+        heapq.heappush(self._heap, (count + weight, key))
+
+    def merge(self, other: "SpaceSaving"):
+        """Adds the counters of another summary (e.g., of another month)."""
+        for key, (count, error) in other._counters.items():
+            self.update(key, count)
+            self._counters[key][1] += error
+
+    def top(self, n: int | None = None):
+        """Returns (key, count, error) with the highest counts first."""
+        top = sorted(
+            ((key, c, e) for key, (c, e) in self._counters.items()),
+            key=lambda t: t[1],
+            reverse=True,
+        )
+        return top[:n]
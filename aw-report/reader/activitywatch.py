@@ -5,6 +5,7 @@ Query ActivityWatch events.
 - Try queries locally: [aw local](http://localhost:5600/#/query)
 """
 
+import json
 import logging
 import re
 from datetime import datetime, timedelta
@@ -13,8 +14,42 @@ import numpy as np
 import pandas as pd
 from aw_client import ActivityWatchClient
 
+from models.space_saving import SpaceSaving
 from utils import flatten_json
 
+# returns the events assigned by the query of a reader
+RETURN_EVENTS = """
+        RETURN = events;
+        """
+
+# bucket ids per aw server (fetched once, see `resolve`)
+_buckets: dict[str, list[str]] = {}
+
+
+def buckets(client: ActivityWatchClient):
+    """Returns the (cached) bucket ids of the client's server."""
+    if client.server_address not in _buckets:
+        _buckets[client.server_address] = sorted(client.get_buckets())
+        logging.getLogger(__name__).debug(f"buckets: {_buckets}")
+    return _buckets[client.server_address]
+
+
+def set_buckets(server_address: str, bucket_ids: list[str]):
+    """Sets the cached bucket ids of a server (e.g., in a worker process)."""
+    _buckets[server_address] = bucket_ids
+
+
+def resolve(client: ActivityWatchClient, query: str):
+    """Replaces `find_bucket` calls in the query by the bucket ids."""
+
+    def bucket(m: re.Match):
+        for b in buckets(client):
+            if b.startswith(json.loads(m.group(1))):
+                return f"{json.dumps(b)}"
+        return m.group(0)  # let aw fail as before
+
+    return re.sub(r'find_bucket\(("[^"]*")\)', bucket, query)
+
 
 class ActivityWatchReader:
     def __init__(self, client: ActivityWatchClient):
@@ -28,13 +63,39 @@ class ActivityWatchReader:
         time_ranges: list[tuple[datetime, datetime]],
         rename: dict | None = None,
         metadata: dict | None = None,
+        per_day: bool = False,
+        periods: list[int] | None = None,
     ):
+        """Queries the events of (disjoint) time ranges at once.
+
+        The events of all time ranges are concatenated, column `period` is the
+        period of the time range (`periods`, defaults to the index of the time
+        range).
+        """
         if rename is None:
             rename = {}
         if metadata is None:
             metadata = {}
-        events = self._client.query(query, time_ranges)[0]
-        df = pd.DataFrame([flatten_json(e, rename) for e in events])
+        if periods is None:
+            periods = list(range(len(time_ranges)))
+        # per day: one time range per day, i.e., merges in the query are per day
+        ranges = (
+            self._days(time_ranges, periods)
+            if per_day
+            else list(zip(periods, time_ranges, strict=True))
+        )
+        results = self._client.query(
+            resolve(self._client, query), [r for _, r in ranges]
+        )
+        rows = []
+        for (i, r), events in zip(ranges, results, strict=True):
+            # tag events with the period of their time range
+            tags = {"period": i, "date": r[0].date()} if per_day else {"period": i}
+            rows.extend(flatten_json(e, rename) | tags for e in events)
+        df = pd.DataFrame(rows)
+        self._set(df, metadata)
+
+    def _set(self, df: pd.DataFrame, metadata: dict):
         # add metadata info to each row
         for k, v in metadata.items():
             df[k] = v
@@ -44,6 +105,91 @@ class ActivityWatchReader:
         # transform for some extra columns for convenience
         self._map()
 
+    def get_categorized(
+        self,
+        query,
+        time_ranges: list[tuple[datetime, datetime]],
+        regexes: dict[str, re.Pattern],
+        keys: list[str],
+        metadata: dict | None = None,
+        periods: list[int] | None = None,
+    ):
+        """Categorizes events on the server and merges them by category and day.
+
+        `query` must assign the events to categorize to `events`. Only the
+        summed duration per category and day is transferred.
+        """
+        if metadata is None:
+            metadata = {}
+        if periods is None:
+            periods = list(range(len(time_ranges)))
+        query += f"""
+        events = categorize(events, {json.dumps(self._rules(regexes, keys))});
+        events = merge_events_by_keys(events, ["$category"]);
+        RETURN = sort_by_duration(events);
+        """
+        days = self._days(time_ranges, periods)
+        results = self._client.query(
+            resolve(self._client, query), [day for _, day in days]
+        )
+        df = pd.DataFrame(
+            [
+                {
+                    "timestamp": e["timestamp"],
+                    "duration": e["duration"],
+                    "category": e["data"]["$category"][0],
+                    "period": i,
+                    "date": day[0].date(),
+                }
+                for (i, day), events in zip(days, results, strict=True)
+                for e in events
+            ],
+            columns=["timestamp", "duration", "category", "period", "date"],
+        )
+        # aw assigns "Uncategorized" if no rule matches
+        df.loc[df.category == "Uncategorized", "category"] = np.nan
+        df["has_category"] = df.category.notna()
+        # add metadata info to each row
+        for k, v in metadata.items():
+            df[k] = v
+        df["type"] = "activitywatch"
+        # save
+        self.events = df
+        self._map()
+        self._logger.debug(f"total: {len(df)}")
+        self._logger.debug(f"has category: {df.has_category.sum()}")
+
+    def _rules(self, regexes: dict[str, re.Pattern], keys: list[str]):
+        """Translates regexes per category to aw categorization rules.
+
+        aw picks the first of equally deep categories, i.e., like
+        `_categorize(..., single=True)` the first match wins.
+        """
+        return [
+            [
+                [category],
+                {
+                    "type": "regex",
+                    "regex": r.pattern,
+                    "ignore_case": bool(r.flags & re.IGNORECASE),
+                    "select_keys": keys,
+                },
+            ]
+            for category, r in regexes.items()
+        ]
+
+    def _days(self, time_ranges: list[tuple[datetime, datetime]], periods: list[int]):
+        """Splits time ranges into ranges of at most one day.
+
+        Returns the period of the time range and the day.
+        """
+        days = []
+        for i, (start, end) in zip(periods, time_ranges, strict=True):
+            while start < end:
+                days.append((i, (start, min(start + timedelta(days=1), end))))
+                start += timedelta(days=1)
+        return days
+
     def _map(self):
         if len(self.events) == 0:
             return  # nothing to map
@@ -52,7 +198,8 @@ class ActivityWatchReader:
             self.events.timestamp, format="ISO8601"
         )
         # add date column from exact timestamp (= starting point of activity)
-        self.events["date"] = self.events.timestamp.dt.date
+        if "date" not in self.events:
+            self.events["date"] = self.events.timestamp.dt.date
         # add time = duration as timedelta
         self.events["time"] = self.events.duration.apply(lambda d: timedelta(seconds=d))
 
@@ -61,10 +208,13 @@ class ActivityWatchReader:
         regexes: dict[str, re.Pattern],
         columns,
         single=False,
+        uncategorized: SpaceSaving | None = None,
     ):
         if len(self.events) == 0:
             return
-        self.events = self._categorize(self.events, regexes, columns, single)
+        self.events = self._categorize(
+            self.events, regexes, columns, single, uncategorized
+        )
 
     def _categorize(
         self,
@@ -72,8 +222,13 @@ class ActivityWatchReader:
         regexes: dict[str, re.Pattern],
         columns,
         single=False,
+        uncategorized: SpaceSaving | None = None,
     ):
-        """Categorizes each event of df given a regex per category."""
+        """Categorizes each event of df given a regex per category.
+
+        Events without category are added to `uncategorized` (weighted by
+        duration) if given.
+        """
         if len(df) == 0:
             return df
 
@@ -104,10 +259,17 @@ class ActivityWatchReader:
                 else len(row.category) > 0,
                 axis=1,
             )
+        has_category = df.has_category.sum()
         self._logger.debug(f"total: {len(df)}")
-        self._logger.debug(f"has category: {len(df[df.has_category])}")
-        if len(df[df.has_category]) < len(df):
-            self._logger.debug(f"missing category, e.g.:\n{df[~df.has_category][0:10]}")
+        self._logger.debug(f"has category: {has_category}")
+        if uncategorized is not None and has_category < len(df):
+            label = " ".join(columns)
+            for *values, duration, has in zip(
+                *(df[c] for c in columns), df.duration, df.has_category, strict=True
+            ):
+                if not has:
+                    value = " ".join(str(v) for v in values if not pd.isna(v))
+                    uncategorized.update((label, value), duration)
 
         return df
 
@@ -124,95 +286,227 @@ class ActivityWatchReader:
 
 
 class ActivityWatchAFKReader(ActivityWatchReader):
-    def get(self, time_ranges: list[tuple[datetime, datetime]]):
-        query = """
+    _rename = {"data": "afk"}
+    _metadata = {"source": "aw-watcher-afk"}
+
+    def query(self):
+        return """
         events = query_bucket(find_bucket("aw-watcher-afk_"));
-        RETURN = sort_by_timestamp(events);
+        events = sort_by_timestamp(events);
         """
+
+    def get(
+        self,
+        time_ranges: list[tuple[datetime, datetime]],
+        periods: list[int] | None = None,
+    ):
         super().get(
-            query,
+            self.query() + RETURN_EVENTS,
             time_ranges,
-            rename={"data": "afk"},
-            metadata={"source": "aw-watcher-afk"},
+            rename=self._rename,
+            metadata=self._metadata,
+            periods=periods,
         )
+
+    def _map(self):
+        super()._map()
+        if len(self.events) == 0:
+            return
         self.events["afk"] = self.events["afk_status"].apply(lambda s: s == "afk")
 
 
 class ActivityWatchEmacsReader(ActivityWatchReader):
-    def get(self, time_ranges: list[tuple[datetime, datetime]]):
-        query = """
+    _query = """
         afk_events = query_bucket(find_bucket("aw-watcher-afk_"));
         events = query_bucket(find_bucket("aw-watcher-emacs_"));
         events = filter_period_intersect(events, filter_keyvals(afk_events, "status", ["not-afk"]));
-        RETURN = sort_by_timestamp(events);
         """
+    _rename = {"data": "editor"}
+    _metadata = {"source": "aw-watcher-emacs"}
+
+    def query(self, per_day=False):
+        query = self._query
+        if per_day:
+            query += """
+        events = merge_events_by_keys(events, ["project", "file", "language"]);
+        """
+        return (
+            query
+            + """
+        events = sort_by_timestamp(events);
+        """
+        )
+
+    def get(
+        self,
+        time_ranges: list[tuple[datetime, datetime]],
+        per_day=False,
+        periods: list[int] | None = None,
+    ):
         super().get(
-            query,
+            self.query(per_day) + RETURN_EVENTS,
             time_ranges,
-            rename={"data": "editor"},
-            metadata={"source": "aw-watcher-emacs"},
+            rename=self._rename,
+            metadata=self._metadata,
+            per_day=per_day,
+            periods=periods,
+        )
+
+    def get_categorized(
+        self,
+        time_ranges: list[tuple[datetime, datetime]],
+        regexes: dict[str, re.Pattern],
+        periods: list[int] | None = None,
+    ):
+        super().get_categorized(
+            self._query,
+            time_ranges,
+            regexes,
+            keys=["project", "file", "language"],
+            metadata=self._metadata,
+            periods=periods,
         )
 
 
 class ActivityWatchIDEReader(ActivityWatchReader):
-    def get(self, time_ranges: list[tuple[datetime, datetime]]):
-        query = """
+    _query = """
         afk_events = query_bucket(find_bucket("aw-watcher-afk_"));
         events = query_bucket(find_bucket("aw-watcher-window_"));
         events = filter_period_intersect(events, filter_keyvals(afk_events, "status", ["not-afk"]));
-        events = filter_keyvals(events, "app", ["Code", "jetbrains-idea-ce"]));
+        events = filter_keyvals(events, "app", ["Code", "jetbrains-idea-ce"]);
+        """
+    _rename = {"data": "editor"}
+    _metadata = {"source": "aw-watcher-window"}
+
+    def query(self):
+        return (
+            self._query
+            + """
         events = merge_events_by_keys(events, ["app", "title"]);
-        RETURN = sort_by_timestamp(events);
+        events = sort_by_timestamp(events);
         """
+        )
+
+    def get(
+        self,
+        time_ranges: list[tuple[datetime, datetime]],
+        per_day=False,
+        periods: list[int] | None = None,
+    ):
         super().get(
-            query,
+            self.query() + RETURN_EVENTS,
+            time_ranges,
+            rename=self._rename,
+            metadata=self._metadata,
+            per_day=per_day,
+            periods=periods,
+        )
+
+    def get_categorized(
+        self,
+        time_ranges: list[tuple[datetime, datetime]],
+        regexes: dict[str, re.Pattern],
+        periods: list[int] | None = None,
+    ):
+        super().get_categorized(
+            self._query,
             time_ranges,
-            rename={"data": "editor"},
-            metadata={"source": "aw-watcher-window"},
+            regexes,
+            keys=["title"],
+            metadata=self._metadata,
+            periods=periods,
         )
 
 
 class ActivityWatchWebReader(ActivityWatchReader):
-    def get(self, time_ranges: list[tuple[datetime, datetime]]):
-        query = """
+    _query = """
         window_events = query_bucket(find_bucket("aw-watcher-window_"));
-        web_events = query_bucket(find_bucket("aw-watcher-web"));
-        web_events = filter_period_intersect(web_events, filter_keyvals(window_events, "app", ["Firefox", "Chrome"]));
-        merged_events = merge_events_by_keys(web_events, ["url", "title"]);
-        RETURN = sort_by_duration(merged_events);
+        events = query_bucket(find_bucket("aw-watcher-web"));
+        events = filter_period_intersect(events, filter_keyvals(window_events, "app", ["Firefox", "Chrome"]));
+        """
+    _rename = {"data": "web"}
+    _metadata = {"source": "aw-watcher-web"}
+
+    def query(self):
+        return (
+            self._query
+            + """
+        events = merge_events_by_keys(events, ["url", "title"]);
+        events = sort_by_duration(events);
         """
+        )
+
+    def get(
+        self,
+        time_ranges: list[tuple[datetime, datetime]],
+        periods: list[int] | None = None,
+    ):
         super().get(
-            query,
+            self.query() + RETURN_EVENTS,
+            time_ranges,
+            rename=self._rename,
+            metadata=self._metadata,
+            periods=periods,
+        )
+
+    def get_categorized(
+        self,
+        time_ranges: list[tuple[datetime, datetime]],
+        regexes: dict[str, re.Pattern],
+        periods: list[int] | None = None,
+    ):
+        super().get_categorized(
+            self._query,
             time_ranges,
-            rename={"data": "web"},
-            metadata={"source": "aw-watcher-web"},
+            regexes,
+            keys=["url", "title"],
+            metadata=self._metadata,
+            periods=periods,
         )
 
 
 class ActivityWatchGitReader(ActivityWatchReader):
-    def get(self, time_ranges: list[tuple[datetime, datetime]]):
-        query = """
+    _rename = {"data": "git"}
+    _metadata = {"source": "aw-git-hooks"}
+
+    def query(self):
+        return """
         events = query_bucket(find_bucket("aw-git-hooks_"));
-        RETURN = sort_by_timestamp(events);
+        events = sort_by_timestamp(events);
         """
+
+    def get(
+        self,
+        time_ranges: list[tuple[datetime, datetime]],
+        periods: list[int] | None = None,
+    ):
         super().get(
-            query,
+            self.query() + RETURN_EVENTS,
             time_ranges,
-            rename={"data": "git"},
-            metadata={"source": "aw-git-hooks"},
+            rename=self._rename,
+            metadata=self._metadata,
+            periods=periods,
         )
 
     def categorize_issues(
         self,
         regex_for_issues: dict[str, re.Pattern],
         regex_for_repos: dict[str, re.Pattern],
+        uncategorized: SpaceSaving | None = None,
     ):
+        """Categorizes commits by issue, or by repo if no issue matches.
+
+        Commits without category are added to `uncategorized` (per issue and
+        repo, weighted by at least 15min like in the activities) if given.
+        """
         if len(self.events) == 0:
             return
 
+        # duplicates of (repo, issue, summary) are caused by amend or reword
         commits = (
             self.events[self.events.git_hook == "post-commit"]
             .explode("git_issues")
+            .drop_duplicates(["git_origin", "git_issues", "git_summary"])
             .reset_index(drop=True)
         )
 
@@ -221,26 +515,84 @@ class ActivityWatchGitReader(ActivityWatchReader):
             return
 
         # categorize git commits according to issues or repos
-        giti = self._categorize(
-            commits.copy(),
-            regex_for_issues,
-            columns=["git_issues"],
-            single=True,
-        )
-        gitr = self._categorize(
-            commits.copy(),
-            regex_for_repos,
-            columns=["git_origin"],
-            single=True,
-        )
-        # update NaNs of category column (issue first, then repo)
-        giti.update(gitr)  # !!has_category probably invalidated!!
-        # re-write has_category  # make it valid again
-        giti.loc[:, "has_category"] = giti.apply(
-            lambda row: not pd.isna(row.category),
-            axis=1,
-        )
-        # drop duplicates
-        giti = giti.drop_duplicates(["git_origin", "git_issues", "git_summary"])
+        # (issue first, then repo)
+        commits["category"] = self._first_match(
+            commits.git_issues, regex_for_issues
+        ).fillna(self._first_match(commits.git_origin, regex_for_repos))
+        commits["has_category"] = commits.category.notna()
+        self._logger.debug(f"total: {len(commits)}")
+        self._logger.debug(f"has category: {commits.has_category.sum()}")
+        if uncategorized is not None:
+            for origin, issue, duration, has in zip(
+                commits.git_origin,
+                commits.git_issues,
+                commits.duration,
+                commits.has_category,
+                strict=True,
+            ):
+                if has:
+                    continue
+                weight = max(duration, timedelta(minutes=15).seconds)
+                uncategorized.update(("git_origin", origin), weight)
+                if not pd.isna(issue):
+                    uncategorized.update(("git_issues", issue), weight)
         # reset git events
-        self.events = giti
+        self.events = commits
+
+    def _first_match(self, values: pd.Series, regexes: dict[str, re.Pattern]):
+        """Maps values to the category of the first matching regex.
+
+        Each unique value is matched only once.
+        """
+
+        def first_match(s: str):
+            for c, r in regexes.items():
+                if r.search(s) is not None:
+                    return c
+            return np.nan
+
+        return values.map({v: first_match(str(v)) for v in values.dropna().unique()})
+
+
+class ActivityWatchBatchReader:
+    """Gets the events of several readers in a single query."""
+
+    def __init__(self, client: ActivityWatchClient):
+        self._logger = logging.getLogger(__name__)
+        self._client = client
+
+    def get(
+        self,
+        readers: dict[str, ActivityWatchReader],
+        time_ranges: list[tuple[datetime, datetime]],
+        periods: list[int] | None = None,
+    ):
+        """Sets the events of each reader (must implement `query`) of all
+        (disjoint) time ranges, tagged with the period of the time range
+        (`periods`, defaults to the index of the time range)."""
+        if periods is None:
+            periods = list(range(len(time_ranges)))
+        query = "".join(
+            reader.query()
+            + f"""
+        events_{name} = events;
+        """
+            for name, reader in readers.items()
+        )
+        query += (
+            "RETURN = {"
+            + ", ".join(f'"{name}": events_{name}' for name in readers)
+            + "};"
+        )
+        results = self._client.query(resolve(self._client, query), time_ranges)
+        for name, reader in readers.items():
+            reader._set(
+                pd.DataFrame(
+                    [
+                        flatten_json(e, reader._rename) | {"period": i}
+                        for i, result in zip(periods, results, strict=True)
+                        for e in result[name]
+                    ]
+                ),
+                reader._metadata,
+            )
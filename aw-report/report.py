@@ -5,17 +5,25 @@ import argparse
 import configparser
 import logging
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
+import pandas as pd
 from aw_client import ActivityWatchClient
 from dateutil.tz import tzlocal
 
+from models.space_saving import SpaceSaving
 from models.working_hours import WorkingHours
 from reader.activitywatch import (
     ActivityWatchAFKReader,
+    ActivityWatchBatchReader,
     ActivityWatchEmacsReader,
     ActivityWatchGitReader,
     ActivityWatchIDEReader,
+    ActivityWatchWebReader,
+    buckets,
+    set_buckets,
 )
 from reader.m365calendar import M365CalendarReader
 from writer.activities import Activities
@@ -28,6 +36,27 @@ DATE_FROM = (
     .replace(day=1, hour=4, minute=0, second=0, microsecond=0)
 )
 DATE_TO = datetime.now().astimezone(tz=tzlocal())
+# number of uncategorized titles, files, repos and issues to track
+TOP_UNCATEGORIZED = 100
+# start of a day
+DAY_START = {"hour": 4, "minute": 0, "second": 0, "microsecond": 0}
+
+
+def period(r: str):
+    """Parses a period FROM:TO (dates, inclusive) to a time range."""
+    try:
+        start, end = (datetime.strptime(d, "%Y-%m-%d") for d in r.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected FROM:TO (YYYY-MM-DD), got {r}"
+        ) from None
+    if start > end:
+        raise argparse.ArgumentTypeError(f"FROM must not be after TO, got {r}")
+    return (
+        start.replace(**DAY_START).astimezone(tz=tzlocal()),
+        (end.replace(**DAY_START) + timedelta(days=1)).astimezone(tz=tzlocal()),
+    )
+
 
 # arguments
 desc = "List activities per date."
@@ -42,6 +71,30 @@ parser.add_argument(
     .astimezone(tz=tzlocal()),
     help=f"""Start date. Defaults to {DATE_FROM} (first day of the current month).""",
 )
+parser.add_argument(
+    "-t",
+    "--to",
+    default=DATE_TO,
+    type=lambda d: (
+        datetime.strptime(d, "%Y-%m-%d").replace(**DAY_START) + timedelta(days=1)
+    ).astimezone(tz=tzlocal()),
+    help="""End date (inclusive). Defaults to now.""",
+)
+parser.add_argument(
+    "-r",
+    "--range",
+    dest="ranges",
+    action="append",
+    type=period,
+    help="""Report the period FROM:TO (dates, inclusive) instead of --from
+    and --to. Repeat for several periods, e.g., sprints or billing periods.""",
+)
+parser.add_argument(
+    "-w",
+    "--workdays",
+    action="store_true",
+    help="""Report workdays (Mon-Fri) only.""",
+)
 parser.add_argument(
     "-v", "--verbose", action="store_true", help="Verbose logging (debug)."
 )
@@ -50,8 +103,57 @@ parser.add_argument(
     "--meetings",
     type=str,
 )
+parser.add_argument(
+    "-c",
+    "--categorize-on-server",
+    action="store_true",
+    help="""Categorize editor and web events in the ActivityWatch query and
+    fetch durations per category and day only.""",
+)
+parser.add_argument(
+    "-d",
+    "--per-day",
+    action="store_true",
+    help="""Merge editor events per day and title in the ActivityWatch query
+    (one time range per day).""",
+)
+parser.add_argument(
+    "--fill",
+    action="store_true",
+    help="""Distribute the working time of each day to the day's activities.""",
+)
+parser.add_argument(
+    "-p",
+    "--partitioned",
+    action="store_true",
+    help="""Process each calendar month of the range in parallel.""",
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    help="""Number of months to process in parallel. Defaults to the CPUs.""",
+)
 args = parser.parse_args()
-DATE_RANGE = (args.date, DATE_TO)
+if args.ranges:
+    # periods must be disjoint (events of overlapping days would count twice)
+    ranges = sorted(args.ranges)
+    for (start, end), (next_start, next_end) in zip(ranges, ranges[1:], strict=False):
+        if next_start < end:
+            parser.error(
+                "periods must not overlap, got "
+                f"{start.date()}:{(end - timedelta(days=1)).date()} and "
+                f"{next_start.date()}:{(next_end - timedelta(days=1)).date()}"
+            )
+# time ranges with the index of their period
+TIME_RANGES = list(enumerate(args.ranges if args.ranges else [(args.date, args.to)]))
+if args.workdays:
+    TIME_RANGES = [
+        (p, (day, min(day + timedelta(days=1), end)))
+        for p, (start, end) in TIME_RANGES
+        for day in (start + timedelta(days=i) for i in range((end - start).days + 1))
+        if day < end and day.isoweekday() <= 5
+    ]
 
 logging.basicConfig(format="[%(levelname)-5s] %(message)s")
 logger = logging.getLogger(__name__)
@@ -66,27 +168,6 @@ config = configparser.ConfigParser()
 config.read("config.ini")
 
 
-# %% Get events
-client = ActivityWatchClient("report-client")
-# active time in front of the PC (afk..away-from-keyboard)
-logger.debug("aw: get afk events")
-afk_all = ActivityWatchAFKReader(client)
-afk_all.get([DATE_RANGE])
-# events from editors
-# on window change the event ends, as expected, i.e. events show active time (per file)
-logger.debug("aw: get editor events")
-edits_all = ActivityWatchIDEReader(client)
-edits_all.get([DATE_RANGE])
-emacs_all = ActivityWatchEmacsReader(client)
-emacs_all.get([DATE_RANGE])
-logger.debug("aw: get git events")
-git_all = ActivityWatchGitReader(client)
-git_all.get([DATE_RANGE])
-# logger.debug(f"aw: get web events")
-# web_all = ActivityWatchWebReader(client)
-# web_all.get([DATE_RANGE])
-
-
 # %% Categorize via regexes
 def regexes(config_section: configparser.SectionProxy):
     return {
@@ -95,68 +176,198 @@ def regexes(config_section: configparser.SectionProxy):
     }
 
 
-# read and compile regexes from config
-r_editor = regexes(config["project.editors"])
-r_git_repos = regexes(config["project.repos"])
-r_git_issues = regexes(config["project.issues"])
-# r_web = regexes(config["project.websites"])
+# %% Report per time range
+def report(time_ranges: list[tuple[int, tuple[datetime, datetime]]]):
+    """Returns working time, git commits, activities and the top uncategorized
+    events of (disjoint) time ranges.
 
-logger.debug("aw: categorize events")
-edits_all.categorize(r_editor, ["editor_title"], single=True)
-emacs_all.categorize(
-    r_editor, ["editor_project", "editor_file", "editor_language"], single=True
-)
-git_all.categorize_issues(r_git_issues, r_git_repos)
-# web_all.categorize(r_web, ["web_url", "web_title"], single=True)
-
-# save git commits separately
-git_all.events.to_csv("git.csv")
-
-# load calendar (not synced in aw)
-if args.meetings is not None:
-    logger.debug("calendar: read m365 json")
-    calendar = M365CalendarReader(args.meetings)
-    # map calendar category to project
-    c2p = {c: p for p, c in config["project.calendar"].items()}
-    calendar.events["project"] = calendar.events["categories"].apply(
-        lambda c: c2p.get(c, c)
+    Events are tagged with the period of their time range (column `period`).
+    """
+    periods = [p for p, _ in time_ranges]
+    time_ranges = [r for _, r in time_ranges]
+    client = ActivityWatchClient("report-client")
+    # active time in front of the PC (afk..away-from-keyboard)
+    afk_all = ActivityWatchAFKReader(client)
+    git_all = ActivityWatchGitReader(client)
+    # events from editors
+    # on window change the event ends, as expected, i.e. events show active time (per file)
+    edits_all = ActivityWatchIDEReader(client)
+    emacs_all = ActivityWatchEmacsReader(client)
+    # get events of all readers with a single query
+    readers = {"afk": afk_all, "git": git_all}
+    if not args.categorize_on_server and not args.per_day:
+        readers |= {"editor": edits_all, "emacs": emacs_all}
+    logger.debug(f"aw: get {', '.join(readers)} events")
+    ActivityWatchBatchReader(client).get(readers, time_ranges, periods)
+
+    # read and compile regexes from config
+    r_editor = regexes(config["project.editors"])
+    r_git_repos = regexes(config["project.repos"])
+    r_git_issues = regexes(config["project.issues"])
+    r_web = regexes(config["project.websites"])
+
+    uncategorized = SpaceSaving(TOP_UNCATEGORIZED)
+    if args.categorize_on_server:
+        logger.debug("aw: get categorized editor and web events")
+        edits_all.get_categorized(time_ranges, r_editor, periods)
+        emacs_all.get_categorized(time_ranges, r_editor, periods)
+        web_all = ActivityWatchWebReader(client)
+        web_all.get_categorized(time_ranges, r_web, periods)
+    else:
+        if args.per_day:
+            logger.debug("aw: get editor events per day")
+            edits_all.get(time_ranges, per_day=True, periods=periods)
+            emacs_all.get(time_ranges, per_day=True, periods=periods)
+        logger.debug("aw: categorize editor events")
+        edits_all.categorize(
+            r_editor, ["editor_title"], single=True, uncategorized=uncategorized
+        )
+        emacs_all.categorize(
+            r_editor,
+            ["editor_project", "editor_file", "editor_language"],
+            single=True,
+            uncategorized=uncategorized,
+        )
+        # web events are too many to categorize locally
+        # web_all = ActivityWatchWebReader(client)
+        # web_all.get(time_ranges)
+        # web_all.categorize(r_web, ["web_url", "web_title"], single=True)
+
+    logger.debug("aw: categorize git events")
+    git_all.categorize_issues(r_git_issues, r_git_repos, uncategorized)
+
+    # load calendar (not synced in aw)
+    if args.meetings is not None:
+        logger.debug("calendar: read m365 json")
+        calendar = M365CalendarReader(args.meetings)
+        # map calendar category to project
+        c2p = {c: p for p, c in config["project.calendar"].items()}
+        calendar.events["project"] = calendar.events["categories"].apply(
+            lambda c: c2p.get(c, c)
+        )
+
+    # activities per date and project
+    if args.meetings is not None:
+        meetings = (
+            pd.concat([calendar.events_within(r) for r in time_ranges])
+            if calendar.events is not None
+            else None
+        )
+        activities = Activities(meetings, git_all.events)
+    else:
+        activities = Activities(git=git_all.events)
+    # replace project with custom project names
+    activities.activities.loc[:, "project"] = activities.activities.project.apply(
+        lambda p: config["project.names"].get(p, p)
     )
 
-# working time per date
-short_pause = timedelta(minutes=10)
-afk = afk_all.events
-afk = (
-    afk[~afk.afk | (afk.duration < short_pause.seconds)]
-    .groupby("date")
-    .agg({"duration": ["sum"], "timestamp": ["min", "max"]})
-)
-# align working hours
-afk[["active", "lunch_incl"]] = afk.apply(
-    lambda r: WorkingHours.align_hours(timedelta(seconds=r["duration", "sum"])),
-    result_type="expand",
-    axis=1,
-)
-afk[["start", "end"]] = afk.apply(
-    lambda r: WorkingHours.align_range(
-        r["timestamp", "min"].to_pydatetime(),
-        r["timestamp", "max"].to_pydatetime(),
-        r["active", ""].to_pytimedelta(),
-    ),
-    result_type="expand",
-    axis=1,
-)
-wt = WorkingTimeWriter(afk)
-wt.save()
-logger.debug("wrote working time to file")
+    # working time per date (aligned after merging the time ranges)
+    short_pause = timedelta(minutes=10)
+    afk = afk_all.events
+    if len(afk) == 0:
+        return None, git_all.events, activities, uncategorized
+    afk = (
+        afk[~afk.afk | (afk.duration < short_pause.seconds)]
+        .groupby("date")
+        .agg({"duration": ["sum"], "timestamp": ["min", "max"]})
+    )
+    return afk, git_all.events, activities, uncategorized
 
-# activities per date and project
-if args.meetings is not None:
-    activities = Activities(calendar.events_within(DATE_RANGE), git_all.events)
-else:
-    activities = Activities(git=git_all.events)
-# replace project with custom project names
-activities.activities.loc[:, "project"] = activities.activities.project.apply(
-    lambda p: config["project.names"].get(p, p)
-)
-activities.save()
-logger.debug("wrote activities to file")
+
+def working_time(afks: list[pd.DataFrame]):
+    """Merges the active time per date of several reports and aligns the
+    working hours."""
+    # a date may be in two reports (dates are of the events' timestamps)
+    afk = (
+        pd.concat(afks)
+        .groupby(level=0)
+        .agg(
+            {
+                ("duration", "sum"): "sum",
+                ("timestamp", "min"): "min",
+                ("timestamp", "max"): "max",
+            }
+        )
+    )
+    # align working hours
+    afk[["active", "lunch_incl"]] = afk.apply(
+        lambda r: WorkingHours.align_hours(timedelta(seconds=r["duration", "sum"])),
+        result_type="expand",
+        axis=1,
+    )
+    afk[["start", "end"]] = afk.apply(
+        lambda r: WorkingHours.align_range(
+            r["timestamp", "min"].to_pydatetime(),
+            r["timestamp", "max"].to_pydatetime(),
+            r["active", ""].to_pytimedelta(),
+        ),
+        result_type="expand",
+        axis=1,
+    )
+    return afk
+
+
+def months(time_ranges: list[tuple[int, tuple[datetime, datetime]]]):
+    """Splits time ranges into calendar months (the time ranges per month,
+    with the index of their period)."""
+    partitions: dict[tuple[int, int], list[tuple[int, tuple[datetime, datetime]]]] = {}
+    for p, (start, end) in time_ranges:
+        while start < end:
+            next_month = (start.replace(day=1) + timedelta(days=32)).replace(
+                day=1, **DAY_START
+            )
+            partitions.setdefault((start.year, start.month), []).append(
+                (p, (start, min(next_month, end)))
+            )
+            start = next_month
+    return [partitions[m] for m in sorted(partitions)]
+
+
+# %% Main
+if __name__ == "__main__":
+    if len(TIME_RANGES) == 0:
+        logger.info("nothing to report (no days in the time ranges)")
+        sys.exit()
+    if args.partitioned:
+        partitions = months(TIME_RANGES)
+        logger.debug(f"process {len(partitions)} months in parallel")
+        # resolve the buckets once for all months
+        client = ActivityWatchClient("report-client")
+        with ProcessPoolExecutor(
+            args.jobs,
+            initializer=set_buckets,
+            initargs=(client.server_address, buckets(client)),
+        ) as executor:
+            results = list(executor.map(report, partitions))
+    else:
+        results = [report(TIME_RANGES)]
+    afks, gits, activities, uncategorized = zip(*results, strict=True)
+    if all(afk is None for afk in afks):
+        logger.info("nothing to report (no activity in the time ranges)")
+        sys.exit()
+
+    # save git commits separately
+    pd.concat(gits, ignore_index=True).to_csv("git.csv")
+
+    wt = WorkingTimeWriter(working_time(afks))
+    activities = Activities.concat(activities)
+    if args.fill:
+        activities.fill(wt.logs["active"])
+    wt.save()
+    logger.debug("wrote working time to file")
+
+    activities.save()
+    logger.debug("wrote activities to file")
+
+    # most costly events without category (to tune the rules in config.ini)
+    top = uncategorized[0]
+    for u in uncategorized[1:]:
+        top.merge(u)
+    pd.DataFrame(
+        [
+            (columns, value, round(duration / 3600, 2), round(error / 3600, 2))
+            for (columns, value), duration, error in top.top()
+        ],
+        columns=["columns", "value", "hours", "error"],
+    ).to_csv("uncategorized.csv", index=False)
+    logger.debug("wrote uncategorized events to file")
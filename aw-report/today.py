@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Prints the working time of today.
+
+Fast path of report.py (e.g., for a status bar): queries today's afk events
+only and does not import pandas.
+"""
+
+# %% Imports
+import argparse
+from array import array
+from datetime import datetime, timedelta
+
+from aw_client import ActivityWatchClient
+from dateutil.tz import tzlocal
+
+from models.working_hours import WorkingHours
+
+# %% Settings
+# afk events shorter than this count as active time (see report.py)
+SHORT_PAUSE = timedelta(minutes=10)
+
+
+def working_time(client: ActivityWatchClient, now: datetime):
+    """Returns active time, first and last active timestamp of today."""
+    day_start = now.replace(hour=4, minute=0, second=0, microsecond=0)
+    if now < day_start:
+        day_start -= timedelta(days=1)
+    query = """
+    events = query_bucket(find_bucket("aw-watcher-afk_"));
+    RETURN = events;
+    """
+    events = client.query(query, [(day_start, now)])[0]
+    durations = array("d")
+    timestamps = array("d")
+    for e in events:
+        if e["data"]["status"] == "afk" and e["duration"] >= SHORT_PAUSE.seconds:
+            continue
+        durations.append(e["duration"])
+        timestamps.append(datetime.fromisoformat(e["timestamp"]).timestamp())
+    if len(timestamps) == 0:
+        return timedelta(0), None, None
+    return (
+        timedelta(seconds=sum(durations)),
+        datetime.fromtimestamp(min(timestamps), tz=tzlocal()),
+        datetime.fromtimestamp(max(timestamps), tz=tzlocal()),
+    )
+
+
+# %% Main
+if __name__ == "__main__":
+    desc = "Print the working time of today."
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument(
+        "-s",
+        "--short",
+        action="store_true",
+        help="Print the active time only (e.g., for a status bar).",
+    )
+    args = parser.parse_args()
+
+    client = ActivityWatchClient("report-client")
+    active, start, end = working_time(client, datetime.now().astimezone(tz=tzlocal()))
+    if args.short:
+        print(WorkingHours.str_delta(active))
+    elif start is None:
+        print("no activity today")
+    else:
+        hours, lunch_incl = WorkingHours.align_hours(active)
+        aligned_start, aligned_end = WorkingHours.align_range(start, end, hours)
+        print(
+            f"active: {WorkingHours.str_delta(active)} "
+            f"({WorkingHours.str_time(start)} - {WorkingHours.str_time(end)})"
+        )
+        print(
+            f"report: {WorkingHours.str_delta(hours)}"
+            + (" incl. lunch" if lunch_incl else "")
+            + f" ({WorkingHours.str_time(aligned_start)}"
+            + f" - {WorkingHours.str_time(aligned_end)})"
+        )
@@ -1,6 +1,7 @@
 import os.path
-from datetime import datetime, timedelta
+from datetime import timedelta
 
+import numpy as np
 import pandas as pd
 
 
@@ -11,15 +12,53 @@ class Activities:
         git: pd.DataFrame | None = None,
     ):
         # input activities
-        if meetings is not None:
-            self._meetings = meetings
-        if git is not None:
-            self._git = git
+        self._meetings = meetings
+        self._git = git
         # aggregate and map to activities
         self._aggregate()
 
-    def fill(self, working_hours: dict[datetime, float]):
-        raise RuntimeError("not yet implemented")
+    def concat(activities: list["Activities"]):
+        """Concatenates activities, e.g., of consecutive months.
+
+        Activities of the same date and project (e.g., of a date in two
+        months) are merged.
+        """
+        a = Activities()
+        a.activities = (
+            pd.concat([x.activities for x in activities], ignore_index=True)
+            .groupby(["date", "project"])
+            .agg({"duration": "sum", "desc": "; ".join})
+            .reset_index()
+        )
+        return a
+
+    def fill(self, working_hours: pd.Series, slot=timedelta(minutes=15)):
+        """Distributes the working hours (timedelta per date) of each day to
+        the day's projects in proportion to their duration.
+
+        Durations are multiples of slot (largest remainder method), so they
+        sum up to the working hours. Days without working hours are kept.
+        """
+        a = self.activities
+        hours = a["date"].map(working_hours)
+        fill = hours.notna()
+        if not fill.any():
+            return
+        a = a[fill]
+        # working hours in slots
+        slots = (hours[fill] / slot).round().astype("int64")
+        duration = a["duration"] / slot
+        total = duration.groupby(a["date"]).transform("sum")
+        count = duration.groupby(a["date"]).transform("count")
+        # share of each project (equal shares if nothing was measured)
+        share = np.where(total > 0, duration / total.where(total > 0, 1), 1 / count)
+        quota = share * slots
+        floor = np.floor(quota).astype("int64")
+        # remaining slots of a day go to the largest remainders
+        remaining = slots - floor.groupby(a["date"]).transform("sum")
+        rank = (quota - floor).groupby(a["date"]).rank(method="first", ascending=False)
+        floor += (rank <= remaining).astype("int64")
+        self.activities.loc[fill, "duration"] = floor * slot
 
     def _aggregate(self):
         """Aggregate inputs to activities per day with one-line description."""
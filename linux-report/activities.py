@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
 import datetime
+import glob
+import json
+import mmap
 import os
 import re
+import struct
 import subprocess
 import textwrap
 
@@ -20,12 +25,164 @@ parser.add_argument('-f', '--from', dest='date',
                     help=f"""Start date. Defaults to
                     {datetime.date.today().replace(day=1)}
                     (first day of the current month).""")
+parser.add_argument('-j', '--jobs', type=int, default=8,
+                    help="""Number of git repos to query in parallel.
+                    Defaults to 8.""")
+parser.add_argument('-w', '--wtmp', metavar="FILE", type=str,
+                    default='/var/log/wtmp',
+                    help="""Login records to read reboots and shutdowns from
+                    (rotated files FILE.N are read too).
+                    Defaults to /var/log/wtmp.""")
+parser.add_argument('-c', '--cache', metavar="FILE", type=str,
+                    default=os.path.join(
+                        os.environ.get('XDG_CACHE_HOME',
+                                       os.path.expanduser('~/.cache')),
+                        'linux-report.json'),
+                    help="""Cache of commits per repo and headlines of
+                    minutes. Defaults to ~/.cache/linux-report.json.""")
 args = parser.parse_args()
 
+# seconds to wait for git per repo
+GIT_TIMEOUT = 30
 
-def execute(cmd):
-    result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE)
-    return result.stdout.decode('utf-8')
+# struct utmp of glibc on Linux (see 'man 5 utmp'):
+# type, pid, line, id, user, host, exit (termination, exit), session, tv_sec,
+# tv_usec, addr, unused
+UTMP = struct.Struct('<hxxi32s4s32s256shhiii16s20s')
+RUN_LVL = 1
+BOOT_TIME = 2
+
+
+def read_wtmp(filename):
+    """Yields (type, user, time) of the records in a wtmp file."""
+    with open(filename, 'rb') as f:
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return  # empty file
+        with m:
+            for offset in range(0, len(m) - UTMP.size + 1, UTMP.size):
+                record = UTMP.unpack_from(m, offset)
+                user = record[4].split(b'\0', 1)[0].decode('utf-8', 'replace')
+                yield record[0], user, \
+                    datetime.datetime.fromtimestamp(record[9])
+
+
+def wtmp_files(filename):
+    """Returns the wtmp file and its rotations, oldest first."""
+    rotated = [fn for fn in glob.glob(glob.escape(filename) + '.*')
+               if fn.rsplit('.', 1)[1].isdigit()]
+    rotated.sort(key=lambda fn: int(fn.rsplit('.', 1)[1]), reverse=True)
+    return rotated + [filename] if os.path.exists(filename) else rotated
+
+
+def boot_sessions(files):
+    """Returns (boot, shutdown) times of the system (like 'last reboot').
+
+    A session without shutdown record (crash) ends with the last record before
+    the next boot, a running session ends with None.
+    """
+    sessions = []
+    boot, last = None, None
+    for fn in files:
+        for ut_type, user, time in read_wtmp(fn):
+            if ut_type == BOOT_TIME:
+                if boot is not None:
+                    sessions.append((boot, last))
+                boot = time
+            elif ut_type == RUN_LVL and user == 'shutdown' \
+                    and boot is not None:
+                sessions.append((boot, time))
+                boot = None
+            last = time
+    if boot is not None:
+        sessions.append((boot, None))
+    return sessions
+
+
+def git_head(repo):
+    """Returns the commit HEAD of repo points to (None if unknown)."""
+    git = os.path.join(repo, '.git')
+    try:
+        with open(os.path.join(git, 'HEAD')) as f:
+            head = f.read().strip()
+        if not head.startswith('ref: '):
+            return head  # detached
+        ref = head[len('ref: '):]
+        if os.path.exists(os.path.join(git, ref)):
+            with open(os.path.join(git, ref)) as f:
+                return f.read().strip()
+        with open(os.path.join(git, 'packed-refs')) as f:
+            for line in f:
+                if line.rstrip('\n').endswith(' ' + ref):
+                    return line.split(' ', 1)[0]
+    except OSError:
+        pass
+    return None
+
+
+def git(repo, *cmd):
+    """Runs a git command in repo (None on timeout)."""
+    try:
+        return subprocess.run(['git', '-C', repo, *cmd],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL,
+                              timeout=GIT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return None
+
+
+def git_log(repo, cached=None):
+    """Returns one line commits ('<iso date> <subject>') of the user in repo
+    and the entry to cache.
+
+    Unchanged repos (same HEAD) are answered from the cache, changed repos
+    are scanned for commits newer than the cached HEAD only.
+    """
+    since = str_date(args.date)
+    # author name from the repo's config (incl. includes of the repo)
+    result = git(repo, 'config', 'user.name')
+    author = result.stdout.decode('utf-8').strip() if result is not None else ''
+    head = git_head(repo)
+
+    def log(revision):
+        result = git(repo, 'log', '--date=iso', f'--since={since}',
+                     '--pretty=format:%aI %s', f'--author={author}', revision)
+        if result is None:
+            return None
+        return [c for c in result.stdout.decode('utf-8').split('\n') if c]
+
+    commits = None
+    if head is not None and cached is not None \
+            and cached['author'] == author and cached['since'] <= since:
+        if cached['head'] == head:
+            commits = cached['commits']
+        else:
+            result = git(repo, 'merge-base', '--is-ancestor',
+                         cached['head'], head)
+            new = log(f"{cached['head']}..{head}") \
+                if result is not None and result.returncode == 0 else None
+            if new is not None:
+                commits = new + cached['commits']
+        if commits is not None:
+            entry = dict(cached, head=head, commits=commits)
+            return [c for c in commits if c[:10] >= since], entry
+    # no cache or history rewritten
+    commits = log(head or 'HEAD')
+    if commits is None:
+        return [], None
+    entry = {'head': head, 'author': author, 'since': since,
+             'commits': commits} if head is not None else None
+    return commits, entry
+
+
+def headline(filename, cache):
+    """Returns the first line of a file (cached by mtime)."""
+    mtime = os.stat(filename).st_mtime
+    if filename not in cache or cache[filename][0] != mtime:
+        with open(filename) as f:
+            cache[filename] = [mtime, f.readline().strip()]
+    return cache[filename][1]
 
 
 def str_date(date):
@@ -43,6 +200,15 @@ def parse_date(string):
 
 
 if __name__ == '__main__':
+    # load cache of previous runs
+    try:
+        with open(args.cache) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache.setdefault('repos', {})
+    cache.setdefault('minutes', {})
+
     # initialize topics per date
     topics = {}
     day = args.date  # start with first day of the month
@@ -52,30 +218,18 @@ if __name__ == '__main__':
                                  'from': None, 'to': None}
         day = day + one_day
 
-    # working hours based on 'last' (reboot and shutdown of Linux)
-    # regex for line in 'last' result
-    p = re.compile('reboot\s+system boot\s+[a-z,0-9,.,-]*\s+\w+\s+([A-Z,a-z]+)\s+(\d+)\s+(\d{2}:\d{2})\s+-\s+(\d{2}:\d{2})')
-    # execute last
-    out = execute(f"""last --since={str_date(args.date)}""")
-    lines = out.split('\n')
-    for l in lines:
-        try:
-            month, day, start, end = p.match(l).groups()
-            date = datetime.datetime.strptime(month, '%b')
-            date = date.replace(day=int(day), year=args.date.year)
-            time = datetime.datetime.strptime(start, '%H:%M')
-            start = date.replace(hour=time.hour, minute=time.minute)
-            time = datetime.datetime.strptime(end, '%H:%M')
-            end = date.replace(hour=time.hour, minute=time.minute)
-        except Exception as e:
-            # skip lines where regex fails (e.g., logins, no reboots)
+    # working hours based on wtmp (reboot and shutdown of Linux)
+    for start, end in boot_sessions(wtmp_files(args.wtmp)):
+        date = str_date(start)
+        # skip the sessions from other months
+        if date not in topics:
             continue
-        # skip the logins from other months
-        if date.month != args.date.month:
-            continue
-        # add time
-        topics[str_date(date)]['from'] = start
-        topics[str_date(date)]['to'] = end
+        # add time (first boot and last shutdown of the day)
+        v = topics[date]
+        if v['from'] is None or start < v['from']:
+            v['from'] = start
+        if end is not None and (v['to'] is None or end > v['to']):
+            v['to'] = end
 
     # minutes
     # assumption:
@@ -103,8 +257,8 @@ if __name__ == '__main__':
                 continue
             # prefer the description from the headline/first line of the file
             # use first line (headline) of the file as topic
-            with open(f"{args.git}/minutes/" + fn) as f:
-                topic = f.readline().strip()
+            topic = headline(os.path.abspath(f"{args.git}/minutes/" + fn),
+                             cache['minutes'])
             # use info in file name as topic
             if topic is None or topic == "" or len(topic) < 3:
                 topic = groups[1]
@@ -118,14 +272,15 @@ if __name__ == '__main__':
         p = re.compile('^(\d{4}-\d{2}-\d{2})')
         # get list of directories
         dirs = os.listdir(args.git)
-        for repo in dirs:
-            # concatenate directory
-            d = args.git + '/' + repo
-            # get author name from git repo
-            author = execute(f'cd {d}; git config user.name').strip()
-            # get one line commits
-            out = execute(f"""cd {d}; git log --date=iso --since={str_date(args.date)} --pretty=format:'%aI %s' --author='{author}'""") + "\n"
-            commits = out.split('\n')
+        # get one line commits of all repos in parallel
+        paths = [os.path.abspath(os.path.join(args.git, repo))
+                 for repo in dirs]
+        with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+            logs = list(executor.map(
+                lambda d: git_log(d, cache['repos'].get(d)), paths))
+        for repo, d, (commits, entry) in zip(dirs, paths, logs):
+            if entry is not None:
+                cache['repos'][d] = entry
             for c in commits:
                 try:
                     # parse
@@ -143,6 +298,14 @@ if __name__ == '__main__':
                     continue
                 topics[date]['git'].append(f"{repo}: {message}")
 
+    # save cache for the next run
+    try:
+        os.makedirs(os.path.dirname(args.cache), exist_ok=True)
+        with open(args.cache, 'w') as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+
     # output
     for k, v in topics.items():
         # skip weekend
@@ -0,0 +1,94 @@
+import datetime
+import importlib.util
+import os
+import struct
+import sys
+
+import pytest
+
+# struct utmp of glibc on x86_64, packed by hand (offsets from <bits/utmp.h>)
+RECORD_SIZE = 384
+OFFSET_TYPE = 0
+OFFSET_USER = 44
+OFFSET_TV_SEC = 340
+
+RUN_LVL = 1
+BOOT_TIME = 2
+USER_PROCESS = 7
+
+
+@pytest.fixture(scope="module")
+def activities():
+    """Imports activities.py (parses the command line on import)."""
+    filename = os.path.join(os.path.dirname(__file__), '..', 'activities.py')
+    spec = importlib.util.spec_from_file_location('activities', filename)
+    module = importlib.util.module_from_spec(spec)
+    argv = sys.argv
+    sys.argv = ['activities.py']
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = argv
+    return module
+
+
+def t(iso):
+    return datetime.datetime.fromisoformat(iso)
+
+
+def record(ut_type, user, time):
+    r = bytearray(RECORD_SIZE)
+    struct.pack_into('<h', r, OFFSET_TYPE, ut_type)
+    r[OFFSET_USER:OFFSET_USER + len(user)] = user
+    struct.pack_into('<i', r, OFFSET_TV_SEC, int(time.timestamp()))
+    return bytes(r)
+
+
+@pytest.fixture
+def wtmp(tmp_path):
+    """wtmp rotated at the end of a month (wtmp.1 is older)."""
+    (tmp_path / 'wtmp.1').write_bytes(
+        record(BOOT_TIME, b'reboot', t('2024-01-31T08:00'))
+        + record(RUN_LVL, b'shutdown', t('2024-01-31T17:00'))
+        + record(BOOT_TIME, b'reboot', t('2024-02-01T08:05')))
+    (tmp_path / 'wtmp').write_bytes(
+        record(USER_PROCESS, b'me', t('2024-02-01T08:06'))
+        + record(RUN_LVL, b'shutdown', t('2024-02-01T16:40'))
+        # crash (no shutdown record)
+        + record(BOOT_TIME, b'reboot', t('2024-02-02T07:55'))
+        + record(USER_PROCESS, b'me', t('2024-02-02T12:00'))
+        # still running
+        + record(BOOT_TIME, b'reboot', t('2024-02-02T13:00')))
+    return str(tmp_path / 'wtmp')
+
+
+def test_record_size(activities):
+    assert activities.UTMP.size == RECORD_SIZE
+
+
+def test_read_wtmp(activities, wtmp):
+    assert list(activities.read_wtmp(wtmp + '.1')) == [
+        (BOOT_TIME, 'reboot', t('2024-01-31T08:00')),
+        (RUN_LVL, 'shutdown', t('2024-01-31T17:00')),
+        (BOOT_TIME, 'reboot', t('2024-02-01T08:05')),
+    ]
+
+
+def test_read_empty_wtmp(activities, tmp_path):
+    (tmp_path / 'wtmp').write_bytes(b'')
+    assert list(activities.read_wtmp(str(tmp_path / 'wtmp'))) == []
+
+
+def test_wtmp_files(activities, wtmp):
+    assert activities.wtmp_files(wtmp) == [wtmp + '.1', wtmp]
+
+
+def test_boot_sessions(activities, wtmp):
+    assert activities.boot_sessions(activities.wtmp_files(wtmp)) == [
+        (t('2024-01-31T08:00'), t('2024-01-31T17:00')),
+        # session across the rotation
+        (t('2024-02-01T08:05'), t('2024-02-01T16:40')),
+        # crash ends with the last record before the next boot
+        (t('2024-02-02T07:55'), t('2024-02-02T12:00')),
+        (t('2024-02-02T13:00'), None),
+    ]
@@ -1,58 +1,171 @@
-# To add a new cell, type '# %%'
-# To add a new markdown cell, type '# %% [markdown]'
+#!/usr/bin/env python3
+"""Story points per sprint of Jira CSV exports.
 
-# %%
-import pandas as pd
-
-# %% Settings
-filename = "my-finished-stories_NETWORK.csv"
-
-# %% Read csv with jira tasks
-data = pd.read_csv(filename, sep=',')
-data.head()
-
-# %% Find column containing story points and rename
-columnStoryPoints = [key for key in data.keys() if "Story Points" in key][0]
-data["Story Points"] = data[columnStoryPoints]
-
-# %% Number of sprints
-data["Sprint"].nunique()
-
-
-# %% Distribution of Story Points
-data.hist("Story Points")
+Writes sum, count, min, max and mean of story points (and of linear points,
+i.e., the rank of the Fibonacci points) per sprint. Each export (board) is
+converted once to a Parquet file in the cache, keyed by its content.
+"""
 
+# %% Imports
+import argparse
+import concurrent.futures
+import hashlib
+import os
 
-# %% Unique values of story points
-data["Story Points"].value_counts()
-
-
-# %% Preprocessing
-# filter columns of interest without NaN values
-points_per_sprint = data[["Story Points", "Sprint"]].dropna()
-# remove "Sprint "
-points_per_sprint["Sprint"] = points_per_sprint["Sprint"].apply(lambda s: int(str(s).replace("Sprint", "").strip()))
-# fibonacci to linear story points
-unique_points = sorted(data["Story Points"].unique())
-points_per_sprint["Points (linear)"] = points_per_sprint["Story Points"].apply(lambda p: unique_points.index(p)+1)
-# no points at all
-points_per_sprint["Count"] = 1
-points_per_sprint.head()
-
-
-# %% Sum of points per sprint
-points_per_sprint.groupby("Sprint").sum().plot()
-
+import pandas as pd
 
-# %% Number of stories per sprint
-points_per_sprint.groupby("Sprint")["Count"].sum().plot()
+# %% Settings
+CHUNKSIZE = 100_000
+CACHE = ".cache"
 
 
-# %% Stories had more points at the beginning
-col = "Story Points"
-for col in ["Story Points", "Points (linear)"]:
-    points_per_sprint.groupby("Sprint").agg(
-        min=(col, min),
-        max=(col, max),
-        mean=(col, lambda x: x.mean())
-    ).plot()
+# %% Read csv with jira tasks
+def read_stories(filename: str, sep: str = ",", chunksize: int = CHUNKSIZE):
+    """Returns sprint number and story points of the stories in an export.
+
+    Reads only the sprint and story points column in chunks.
+    """
+    # find column containing story points (jira names it "Custom field (...)")
+    header = pd.read_csv(filename, sep=sep, nrows=0).columns
+    columnSprint = header.get_loc("Sprint")
+    columnStoryPoints = [i for i, key in enumerate(header) if "Story Points" in key][0]
+    columns = sorted([(columnSprint, "Sprint"), (columnStoryPoints, "Story Points")])
+    chunks = pd.read_csv(
+        filename,
+        sep=sep,
+        header=0,
+        usecols=[i for i, _ in columns],
+        names=[name for _, name in columns],
+        dtype={"Sprint": "string", "Story Points": "float64"},
+        chunksize=chunksize,
+    )
+    stories = [
+        chunk.dropna(subset=["Story Points"])
+        # remove "Sprint "
+        .assign(Sprint=lambda c: pd.to_numeric(c.Sprint.str.extract(r"(\d+)$")[0]))
+        .astype({"Sprint": "Int64"})
+        for chunk in chunks
+    ]
+    return pd.concat(stories, ignore_index=True)
+
+
+def convert(
+    filename: str, cache: str = CACHE, sep: str = ",", chunksize: int = CHUNKSIZE
+):
+    """Converts an export to Parquet (once per content) and returns its path."""
+    h = hashlib.sha256(sep.encode())
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    parquet = os.path.join(cache, f"{h.hexdigest()}.parquet")
+    if not os.path.exists(parquet):
+        stories = read_stories(filename, sep, chunksize)
+        # write to a temporary file first, other runs may read the cache
+        stories.to_parquet(f"{parquet}.{os.getpid()}", index=False)
+        os.replace(f"{parquet}.{os.getpid()}", parquet)
+    return parquet
+
+
+# %% Aggregate per sprint
+def count_points(stories: pd.DataFrame):
+    """Returns the number of stories per sprint and story points."""
+    return stories.value_counts(["Sprint", "Story Points"], dropna=False)
+
+
+def points_per_sprint(counts: pd.Series):
+    """Returns sum, count, min, max and mean of points per sprint given the
+    number of stories per sprint and story points."""
+    counts = counts.rename("Count").reset_index()
+    # fibonacci to linear story points
+    unique_points = pd.Index(sorted(counts["Story Points"].unique()))
+    counts["Points (linear)"] = unique_points.get_indexer(counts["Story Points"]) + 1
+    # stories without sprint count for the linear points only
+    counts = counts.dropna(subset=["Sprint"]).astype({"Sprint": "int64"})
+    per_sprint = {}
+    for col in ["Story Points", "Points (linear)"]:
+        weighted = counts[col] * counts["Count"]
+        per_sprint[col] = (
+            counts.assign(weighted=weighted)
+            .groupby("Sprint")
+            .agg(
+                sum=("weighted", "sum"),
+                count=("Count", "sum"),
+                min=(col, "min"),
+                max=(col, "max"),
+            )
+            .assign(mean=lambda a: a["sum"] / a["count"])
+        )
+    return per_sprint
+
+
+def save(per_sprint: dict[str, pd.DataFrame], output: str, prefix: str = ""):
+    for col, table in per_sprint.items():
+        name = col.lower().replace(" ", "-").replace("(", "").replace(")", "")
+        table.to_csv(os.path.join(output, f"{prefix}{name}_per_sprint.csv"))
+
+
+# %% Main
+if __name__ == "__main__":
+    desc = "Story points per sprint of Jira CSV exports (one per board)."
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("filenames", nargs="+", help="Jira CSV exports.")
+    parser.add_argument(
+        "-s", "--sep", default=",", help="Separator of the CSV. Defaults to ','."
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=".",
+        help="Directory to write the tables to. Defaults to the current directory.",
+    )
+    parser.add_argument(
+        "--cache",
+        default=CACHE,
+        help=f"Directory of the converted exports. Defaults to {CACHE}.",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunksize",
+        type=int,
+        default=CHUNKSIZE,
+        help=f"Rows to read at once. Defaults to {CHUNKSIZE}.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of exports to convert in parallel. Defaults to the CPUs.",
+    )
+    args = parser.parse_args()
+    # board is the file name (used as prefix of the tables per board)
+    boards = [os.path.splitext(os.path.basename(f))[0] for f in args.filenames]
+    duplicates = sorted({b for b in boards if boards.count(b) > 1})
+    if duplicates:
+        parser.error(f"exports need unique file names, got {', '.join(duplicates)}")
+
+    os.makedirs(args.cache, exist_ok=True)
+    os.makedirs(args.output, exist_ok=True)
+    # convert new exports in parallel
+    n = len(args.filenames)
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+        parquets = list(
+            executor.map(
+                convert,
+                args.filenames,
+                [args.cache] * n,
+                [args.sep] * n,
+                [args.chunksize] * n,
+            )
+        )
+
+    # per board
+    counts = {}
+    for board, parquet in zip(boards, parquets, strict=True):
+        counts[board] = count_points(pd.read_parquet(parquet))
+        if n > 1:
+            save(points_per_sprint(counts[board]), args.output, f"{board}_")
+
+    # cross-board
+    total = pd.concat(counts.values()).groupby(level=[0, 1], dropna=False).sum()
+    save(points_per_sprint(total), args.output)